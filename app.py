@@ -4,132 +4,43 @@
 Emby 入库通知 Telegram Bot - 主应用
 """
 
+import atexit
 import json
 import logging
+import logging.handlers
+import queue
 import re
-from typing import Optional
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from config import Config
 from parser import EmbyDataParser
 from telegram_client import TelegramClient
 from templates import TemplateManager
 from notification_aggregator import NotificationAggregator
-from utils import find_tmdb_id
-
-
-def _get_tmdb_info(template_vars: dict) -> tuple[Optional[str], Optional[str]]:
-    """
-    从 TMDB 获取图片 URL 和中文简介
-    
-    Args:
-        template_vars: 模板变量字典
-    
-    Returns:
-        (image_url, overview_zh) 元组，如果获取失败则返回 (None, None)
-    """
-    tmdb_id = template_vars.get('tmdb_id')
-    
-    # 如果没有 TMDB ID，尝试通过其他信息查找
-    if not tmdb_id:
-        imdb_id = template_vars.get('imdb_id')
-        title_year = template_vars.get('title_year', '')
-        # 从 title_year 中提取标题和年份（格式如 "剧名 (2023)"）
-        title = title_year
-        year = None
-        if '(' in title_year and ')' in title_year:
-            # 尝试提取年份
-            match = re.search(r'\((\d{4})\)', title_year)
-            if match:
-                year = int(match.group(1))
-                title = title_year[:title_year.rfind('(')].strip()
-        
-        media_type = template_vars.get('media_type', 'movie')
-        found_tmdb_id = find_tmdb_id(
-            imdb_id=imdb_id,
-            title=title if title else None,
-            year=year,
-            media_type=media_type,
-            api_key=Config.TMDB_API_KEY
-        )
-        
-        if found_tmdb_id:
-            tmdb_id = found_tmdb_id
-            # 更新 template_vars 以便后续使用
-            template_vars['tmdb_id'] = found_tmdb_id
-            template_vars['tmdbid'] = found_tmdb_id
-    
-    if not tmdb_id:
-        return None, None
-    
-    media_type = template_vars.get('media_type', 'movie')  # 'tv' 或 'movie'
-    
-    # 检查是否配置了 API Key
-    api_key = Config.TMDB_API_KEY
-    if not api_key:
-        logger.debug("TMDB_API_KEY 未配置，跳过图片和简介获取")
-        return None, None
-    
-    try:
-        # 使用 TMDB API 获取信息（优先中文）
-        api_url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}?api_key={api_key}&language=zh-CN"
-        
-        logger.debug(f"正在从 TMDB 获取信息: {media_type}/{tmdb_id}")
-        response = requests.get(api_url, timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # 获取图片 URL
-            image_url = None
-            poster_path = data.get('poster_path')
-            if poster_path:
-                base_url = Config.TMDB_IMAGE_BASE_URL.rstrip('/')
-                image_url = f"{base_url}{poster_path}"
-                logger.debug(f"获取到 TMDB 图片: {image_url}")
-            else:
-                logger.debug("TMDB 数据中没有 poster_path")
-            
-            # 获取中文简介（必须是中文，如果没有中文简介则不使用）
-            overview_zh = data.get('overview')
-            if overview_zh:
-                logger.debug(f"获取到 TMDB 中文简介: {overview_zh[:50]}...")
-            else:
-                logger.debug("TMDB 数据中没有中文简介")
-            
-            return image_url, overview_zh
-        else:
-            logger.warning(f"TMDB API 返回错误状态码: {response.status_code}, 响应: {response.text[:200]}")
-    except Exception as e:
-        logger.warning(f"从 TMDB 获取信息失败: {e}")
-    
-    return None, None
-
-
-def _build_image_url(template_vars: dict) -> Optional[str]:
-    """
-    从 TMDB 获取图片 URL（兼容旧接口）
-    
-    Args:
-        template_vars: 模板变量字典
-    
-    Returns:
-        图片 URL 或 None
-    """
-    image_url, _ = _get_tmdb_info(template_vars)
-    return image_url
 
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# 业务线程只把日志记录放入队列，由后台监听线程负责写入 stderr，避免 I/O 阻塞请求处理
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# 入队前只合并消息参数（及异常堆栈），完整格式由监听线程的 StreamHandler 输出
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler])
+_log_listener.start()
+# 最先注册、最后执行，确保其他退出处理函数输出的日志也能写出
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # 初始化 Flask 应用
 app = Flask(__name__)
+# 请求体大小上限由 Werkzeug 在读取请求流时检查（包括没有 Content-Length 的分块请求），超过时抛出 413
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_WEBHOOK_BYTES
 
 # 初始化组件
 parser = EmbyDataParser()
@@ -141,84 +52,138 @@ aggregator = NotificationAggregator(
     parser=parser,
     aggregation_delay=Config.AGGREGATION_DELAY
 )
+# 退出时发送仍在聚合中的通知（在日志监听线程停止之前执行）
+atexit.register(aggregator.flush_all)
+
+# 事件类型嗅探：只扫描请求体前若干字节，匹配不到时再完整解析
+_EVENT_SNIFF_RE = re.compile(rb'"Event"\s*:\s*"([^"]+)"')
+_EVENT_SNIFF_BYTES = 2048
+
+# webhook 后台处理线程池及积压上限
+_webhook_executor = ThreadPoolExecutor(max_workers=Config.WEBHOOK_WORKERS, thread_name_prefix='webhook')
+_webhook_slots = threading.BoundedSemaphore(Config.WEBHOOK_QUEUE_MAX)
+
+
+def _process_notification(data: dict):
+    """
+    后台处理 library.new 通知：交给聚合器解析、聚合和发送
+    
+    Args:
+        data: Emby webhook 数据
+    """
+    try:
+        # 使用聚合器处理通知（剧集会聚合，电影直接发送）
+        # TMDB 图片和中文简介在聚合器发送时才获取，聚合中的每一集不再单独请求 TMDB
+        success = aggregator.add_notification(data)
+        if not success:
+            logger.error("处理通知失败")
+    except Exception as e:
+        logger.exception(f"后台处理通知时出错: {e}")
 
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """接收 Emby webhook"""
     try:
-        data = request.get_json()
+        # Content-Length 超限时 get_data 直接抛出 413；分块请求（没有 Content-Length）读到上限时只截断，
+        # 再读一个字节，超限时由 Werkzeug 抛出 413
+        body = request.get_data()
+        if request.content_length is None and len(body) >= Config.MAX_WEBHOOK_BYTES:
+            request.stream.read(1)
+        
+        # 先在请求体开头查找事件类型，非 library.new 事件无需解析整个 JSON
+        sniffed = _EVENT_SNIFF_RE.search(body, 0, _EVENT_SNIFF_BYTES)
+        if sniffed and sniffed.group(1) != b'library.new':
+            event = sniffed.group(1).decode('utf-8', 'replace')
+            logger.info("忽略事件: %s", event)
+            return jsonify({'status': 'ignored', 'message': f'Event {event} ignored'}), 200
+        
+        # 原始请求体已缓存，不需要再缓存解析结果；格式错误时按空请求处理
+        data = request.get_json(cache=False, silent=True)
         
         if not data:
             logger.warning("收到空请求")
             return jsonify({'status': 'error', 'message': 'Empty request'}), 400
         
-        logger.info(f"收到 webhook 数据: {json.dumps(data, ensure_ascii=False)[:200]}...")
-        
         # 只处理 library.new 事件
         event = parser.get_event(data)
         
         if event != 'library.new':
-            logger.info(f"忽略事件: {event}")
+            # 忽略的事件只记录事件名和条目名，不序列化整个请求体
+            item = data.get('Item') if isinstance(data, dict) else None
+            logger.info("忽略事件: %s, 条目: %s", event, item.get('Name') if isinstance(item, dict) else None)
             return jsonify({'status': 'ignored', 'message': f'Event {event} ignored'}), 200
         
-        # 解析数据获取基本信息
-        template_vars = parser.parse(data)
-        if template_vars:
-            # 从 TMDB 获取图片和中文简介
-            image_url, overview_zh = _get_tmdb_info(template_vars)
-            if image_url:
-                template_vars['_tmdb_image_url'] = image_url
-            if overview_zh:
-                template_vars['overview'] = overview_zh
-                template_vars['overview_source'] = 'tmdb'
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("收到 webhook 数据: %.200s...", json.dumps(data, ensure_ascii=False))
         
-        # 使用聚合器处理通知（剧集会聚合，电影直接发送）
-        # 将更新后的 template_vars 传递回去（通过重新解析，但保留 TMDB 信息）
-        success = aggregator.add_notification(data, template_vars_override=template_vars if template_vars else None)
+        # 有界积压：超过上限时直接拒绝，让 Emby 稍后重试
+        if not _webhook_slots.acquire(blocking=False):
+            logger.warning("待处理通知过多，拒绝本次 webhook")
+            return jsonify({'status': 'error', 'message': 'Too many pending notifications'}), 503
+        
+        # TMDB 查询和聚合在后台线程中完成，尽快响应 Emby
+        try:
+            future = _webhook_executor.submit(_process_notification, data)
+        except RuntimeError:
+            # 线程池已关闭（服务退出中）：归还名额，让 Emby 稍后重试
+            _webhook_slots.release()
+            logger.warning("后台线程池已关闭，拒绝本次 webhook")
+            return jsonify({'status': 'error', 'message': 'Service shutting down'}), 503
+        future.add_done_callback(lambda _: _webhook_slots.release())
         
-        if success:
-            return jsonify({'status': 'success', 'message': 'Notification queued'}), 200
-        else:
-            return jsonify({'status': 'error', 'message': 'Failed to process notification'}), 500
+        return jsonify({'status': 'queued', 'message': 'Notification queued'}), 202
             
+    except RequestEntityTooLarge:
+        # 请求体过大（超过 MAX_CONTENT_LENGTH），不读取、不解析，直接拒绝
+        logger.warning(f"webhook 请求体过大: {request.content_length or '未知'} 字节")
+        return jsonify({'status': 'error', 'message': 'Request too large'}), 413
     except Exception as e:
         logger.exception(f"处理 webhook 时出错: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+# /health 和 / 的响应内容在启动后不会变化，预先序列化
+_HEALTH_BODY = app.json.response({
+    'status': 'ok',
+    'telegram_configured': Config.is_telegram_configured()
+}).get_data()
+_INDEX_BODY = app.json.response({
+    'name': 'Emby Telegram Notifier',
+    'version': '1.0.0',
+    'endpoints': {
+        'webhook': '/webhook (POST)',
+        'health': '/health (GET)'
+    }
+}).get_data()
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """健康检查"""
-    return jsonify({
-        'status': 'ok',
-        'telegram_configured': Config.is_telegram_configured()
-    }), 200
+    return app.response_class(_HEALTH_BODY, mimetype=app.json.mimetype), 200
 
 
 @app.route('/', methods=['GET'])
 def index():
     """首页"""
-    return jsonify({
-        'name': 'Emby Telegram Notifier',
-        'version': '1.0.0',
-        'endpoints': {
-            'webhook': '/webhook (POST)',
-            'health': '/health (GET)'
-        }
-    }), 200
+    return app.response_class(_INDEX_BODY, mimetype=app.json.mimetype), 200
 
 
-def main():
-    """主函数"""
-    # 检查配置
+def check_config():
+    """检查配置，缺失时输出警告"""
     is_valid, error_msg = Config.validate()
     if not is_valid:
         logger.warning(f"警告：配置验证失败 - {error_msg}")
         logger.warning("程序将无法正常工作，请检查环境变量配置")
+
+
+def main():
+    """主函数（开发/调试用，生产环境请使用 gunicorn 运行 wsgi:app）"""
+    check_config()
     
     logger.info(f"启动 Emby Telegram 通知服务，监听 {Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT}")
-    app.run(host=Config.WEBHOOK_HOST, port=Config.WEBHOOK_PORT, debug=False)
+    app.run(host=Config.WEBHOOK_HOST, port=Config.WEBHOOK_PORT, debug=False, threaded=True)
 
 
 if __name__ == '__main__':
@@ -18,6 +18,9 @@ class Config:
     # Webhook 服务配置
     WEBHOOK_HOST: str = os.getenv('WEBHOOK_HOST', '0.0.0.0')
     WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', '5000'))
+    WEBHOOK_WORKERS: int = int(os.getenv('WEBHOOK_WORKERS', '8'))  # 后台处理 webhook 的线程数
+    WEBHOOK_QUEUE_MAX: int = int(os.getenv('WEBHOOK_QUEUE_MAX', '256'))  # 最多积压的待处理 webhook 数，超过后返回 503
+    MAX_WEBHOOK_BYTES: int = int(os.getenv('MAX_WEBHOOK_BYTES', str(1024 * 1024)))  # webhook 请求体大小上限（字节）
     
     # 聚合通知配置
     AGGREGATION_DELAY: int = int(os.getenv('AGGREGATION_DELAY', '10'))  # 聚合延迟时间（秒）
@@ -25,6 +28,15 @@ class Config:
     # TMDB 配置（用于获取图片）
     TMDB_API_KEY: str = os.getenv('TMDB_API_KEY', '')  # TMDB API Key（可选，但推荐配置以获得更好的访问速度）
     TMDB_IMAGE_BASE_URL: str = os.getenv('TMDB_IMAGE_BASE_URL', 'https://image.tmdb.org/t/p/w500')  # TMDB 图片基础 URL
+    TMDB_CACHE_TTL: int = int(os.getenv('TMDB_CACHE_TTL', str(7 * 24 * 3600)))  # TMDB 信息缓存有效期（秒），默认 7 天
+    TMDB_CACHE_MAX: int = int(os.getenv('TMDB_CACHE_MAX', '2048'))  # TMDB 信息缓存最大条目数
+    
+    # 模板配置
+    USE_JINJA_TEMPLATES: bool = os.getenv('USE_JINJA_TEMPLATES', '').lower() in ('1', 'true', 'yes')  # 使用 Jinja2 模板渲染消息（默认使用更快的 Python 实现）
+    JINJA_CACHE_DIR: str = os.getenv('JINJA_CACHE_DIR', '')  # Jinja2 字节码缓存目录，为空时使用系统临时目录
+    
+    # 环境变量只在启动时读取，配置状态可以预先计算
+    _IS_TELEGRAM_CONFIGURED: bool = bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
     
     @classmethod
     def validate(cls) -> Tuple[bool, Optional[str]]:
@@ -45,5 +57,5 @@ class Config:
     @classmethod
     def is_telegram_configured(cls) -> bool:
         """检查 Telegram 是否已配置"""
-        return bool(cls.TELEGRAM_BOT_TOKEN and cls.TELEGRAM_CHAT_ID)
+        return cls._IS_TELEGRAM_CONFIGURED
 
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置
+"""
+
+from config import Config
+
+bind = f"{Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT}"
+
+# 聚合器的待发送队列保存在进程内存中，多个 worker 进程会把同一季的剧集拆散，
+# 因此只使用一个 worker 进程，通过线程处理并发请求（TMDB/Telegram 请求都是 I/O 密集型）
+workers = 1
+worker_class = 'gthread'
+threads = 16
+
+accesslog = '-'
@@ -5,22 +5,214 @@
 用于聚合同一部剧的多集通知
 """
 
+import heapq
 import logging
 import re
 import threading
-from typing import Dict, List, Optional, Any, Tuple
-from collections import defaultdict
-from datetime import datetime, timedelta
+import time
+from urllib.parse import quote
+from typing import Deque, Dict, Iterator, List, Optional, Any, Tuple
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 from parser import EmbyDataParser
 from telegram_client import TelegramClient
 from templates import TemplateManager
 from config import Config
-from utils import find_tmdb_id
+from utils import find_tmdb_id, format_size
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+# TMDB 详情请求的超时（连接, 读取）和重试设置
+_TMDB_TIMEOUT = (2, 5)
+_TMDB_RETRIES = 2
+_TMDB_BACKOFF = 0.2
+# 单次详情请求的最长耗时：每次尝试的连接 + 读取超时，加上重试间的退避
+# （urllib3 第 n 次重试前等待 backoff * 2**(n-1)，第一次重试不等待；不使用 Retry-After，保证耗时有上限）
+_TMDB_FETCH_BUDGET = (_TMDB_RETRIES + 1) * sum(_TMDB_TIMEOUT) + sum(
+    _TMDB_BACKOFF * 2 ** (n - 1) for n in range(2, _TMDB_RETRIES + 1)
+)
+
+# TMDB 请求复用同一个 Session，保持 keep-alive 连接，避免每次请求都重新握手
+_TMDB_SESSION = requests.Session()
+_TMDB_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=_TMDB_RETRIES, backoff_factor=_TMDB_BACKOFF, status_forcelist=[429, 500, 502, 503, 504],
+                      respect_retry_after_header=False, raise_on_status=False)
+))
+# 声明 urllib3 能解码的所有压缩格式（gzip/deflate，安装 brotli 时还包括 br），TMDB 返回压缩后的 JSON
+_TMDB_SESSION.headers.update({'Accept': 'application/json', 'Accept-Encoding': ACCEPT_ENCODING})
+_TMDB_IMAGE_BASE = Config.TMDB_IMAGE_BASE_URL.rstrip('/')
+_TMDB_BASE = "https://api.themoviedb.org/3"
+_TMDB_PARAMS_BASE = {'language': 'zh-CN'}
+if Config.TMDB_API_KEY:
+    _TMDB_PARAMS_BASE['api_key'] = Config.TMDB_API_KEY
+
+# TMDB 详情缓存（LRU + TTL）
+# key: (media_type, tmdb_id, language)
+# value: (获取时间 monotonic, image_url, overview_zh, etag)
+_tmdb_cache: "OrderedDict[tuple, tuple[float, Optional[str], Optional[str], Optional[str]]]" = OrderedDict()
+_tmdb_cache_lock = threading.Lock()
+# 正在后台刷新的缓存键，避免重复提交刷新任务
+_tmdb_refreshing: set = set()
+_tmdb_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tmdb-refresh')
+# 正在进行中的 TMDB 请求（single-flight），相同键的并发调用共享同一个结果
+_tmdb_inflight: dict[tuple, Future] = {}
+_tmdb_inflight_lock = threading.Lock()
+# TMDB 返回 304 Not Modified 时 _fetch_tmdb_details 的返回值
+_NOT_MODIFIED = object()
+
+# 从 "剧名 (2023)" 形式的标题中提取年份
+_YEAR_RE = re.compile(r'\((\d{4})\)')
+
+
+def _fetch_tmdb_details(media_type: str, tmdb_id, etag: Optional[str] = None):
+    """
+    请求 TMDB 详情接口
+    
+    Args:
+        media_type: 'tv' 或 'movie'
+        tmdb_id: TMDB ID
+        etag: 上次响应的 ETag，提供时发送条件请求
+    
+    Returns:
+        (image_url, overview_zh, etag) 元组；内容未变化（304）时返回 _NOT_MODIFIED；
+        请求失败时返回 None（失败结果不写入缓存）
+    """
+    try:
+        # 使用 TMDB API 获取信息（优先中文），查询参数由 requests 负责编码
+        logger.debug(f"正在从 TMDB 获取信息: {media_type}/{tmdb_id}")
+        headers = {'If-None-Match': etag} if etag else None
+        # stream=False：立即读完响应体，连接马上归还连接池
+        response = _TMDB_SESSION.get(f"{_TMDB_BASE}/{media_type}/{tmdb_id}", params=_TMDB_PARAMS_BASE,
+                                     headers=headers, timeout=_TMDB_TIMEOUT, stream=False)
+        
+        if response.status_code == 304:
+            logger.debug(f"TMDB 信息未变化: {media_type}/{tmdb_id}")
+            return _NOT_MODIFIED
+        
+        if response.status_code == 200:
+            data = response.json()
+            
+            # 获取图片 URL
+            image_url = None
+            poster_path = data.get('poster_path')
+            if poster_path:
+                image_url = f"{_TMDB_IMAGE_BASE}{poster_path}"
+                logger.debug(f"获取到 TMDB 图片: {image_url}")
+            else:
+                logger.debug("TMDB 数据中没有 poster_path")
+            
+            # 获取中文简介（必须是中文，如果没有中文简介则不使用）
+            overview_zh = data.get('overview')
+            if overview_zh:
+                logger.debug(f"获取到 TMDB 中文简介: {overview_zh[:50]}...")
+            else:
+                logger.debug("TMDB 数据中没有中文简介")
+            
+            return image_url, overview_zh, response.headers.get('ETag')
+        else:
+            logger.warning(f"TMDB API 返回错误状态码: {response.status_code}, 响应: {response.text[:200]}")
+    except Exception as e:
+        logger.warning(f"从 TMDB 获取信息失败: {e}")
+    
+    return None
+
+
+def _tmdb_cache_get(key: tuple) -> Optional[tuple[float, Optional[str], Optional[str], Optional[str]]]:
+    """读取 TMDB 缓存条目，命中时标记为最近使用"""
+    with _tmdb_cache_lock:
+        entry = _tmdb_cache.get(key)
+        if entry is not None:
+            _tmdb_cache.move_to_end(key)
+        return entry
+
+
+def _tmdb_cache_put(key: tuple, image_url: Optional[str], overview_zh: Optional[str], etag: Optional[str]):
+    """写入 TMDB 缓存条目，超出容量时淘汰最久未使用的条目"""
+    with _tmdb_cache_lock:
+        _tmdb_cache[key] = (time.monotonic(), image_url, overview_zh, etag)
+        _tmdb_cache.move_to_end(key)
+        while len(_tmdb_cache) > Config.TMDB_CACHE_MAX:
+            _tmdb_cache.popitem(last=False)
+
+
+def _tmdb_cache_touch(key: tuple):
+    """TMDB 返回 304 时只更新缓存时间，不重新解析内容"""
+    with _tmdb_cache_lock:
+        entry = _tmdb_cache.get(key)
+        if entry is not None:
+            _tmdb_cache[key] = (time.monotonic(),) + entry[1:]
+
+
+def _schedule_tmdb_refresh(key: tuple):
+    """在后台刷新过期的 TMDB 缓存条目（同一个键同时只刷新一次）"""
+    with _tmdb_cache_lock:
+        if key in _tmdb_refreshing:
+            return
+        _tmdb_refreshing.add(key)
+    try:
+        _tmdb_refresh_executor.submit(_refresh_tmdb_cache, key)
+    except RuntimeError:
+        # 解释器退出中线程池不再接受任务：放弃本次刷新，继续使用旧值
+        with _tmdb_cache_lock:
+            _tmdb_refreshing.discard(key)
+
+
+def _refresh_tmdb_cache(key: tuple):
+    """后台刷新任务（带 ETag 的条件请求，内容未变化时 TMDB 只返回 304）"""
+    try:
+        media_type, tmdb_id, _ = key
+        entry = _tmdb_cache_get(key)
+        result = _fetch_tmdb_details(media_type, tmdb_id, etag=entry[3] if entry else None)
+        if result is _NOT_MODIFIED:
+            _tmdb_cache_touch(key)
+        elif result is not None:
+            _tmdb_cache_put(key, *result)
+    finally:
+        with _tmdb_cache_lock:
+            _tmdb_refreshing.discard(key)
+
+# Telegram 发送限速：全局上限 30 条/秒，留出余量
+_TG_GLOBAL_RATE = 25
+
+
+class _RateLimiter:
+    """令牌桶限速器（线程安全）
+    
+    令牌不足时预先扣减并在锁外等待，多个线程按到达顺序依次排开
+    """
+    
+    def __init__(self, rate: float, capacity: float):
+        """
+        初始化限速器
+        
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的最大突发数）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, tokens: float = 1):
+        """取得令牌，不足时阻塞到令牌补足"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
 
 class NotificationAggregator:
     """通知聚合器
@@ -43,22 +235,41 @@ class NotificationAggregator:
             aggregation_delay: 聚合延迟时间（秒），默认 10 秒
         """
         self.telegram_client = telegram_client
+        # Telegram 配置在运行期间不会变化，创建时判断一次；未配置时不解析、不查询 TMDB、不渲染
+        self._telegram_configured = telegram_client.is_configured()
+        if not self._telegram_configured:
+            logger.warning("Telegram 配置缺失：BOT_TOKEN 或 CHAT_ID 未设置，收到的通知将被跳过")
         self.template_manager = template_manager
         self.parser = parser
         self.aggregation_delay = aggregation_delay
         
         # 存储待聚合的通知
         # key: (series_id, season_id) 或 movie_id
-        # value: List[template_vars]
-        self.pending_notifications: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        # value: Deque[通知]
+        self.pending_notifications: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
         
-        # 存储定时器
-        # key: (series_id, season_id) 或 movie_id
-        # value: threading.Timer
-        self.timers: Dict[str, threading.Timer] = {}
+        # 每个聚合键的发送截止时间（time.monotonic）
+        self._deadlines: Dict[str, float] = {}
         
-        # 锁，保护共享数据
+        # 截止时间小顶堆 (deadline, key)
+        # 聚合键被推迟时旧条目留在堆中，出堆时与 _deadlines 不一致的条目直接丢弃
+        self._heap: List[Tuple[float, str]] = []
+        
+        # 锁，保护 pending_notifications 和调度数据（只短暂持有）
         self.lock = threading.Lock()
+        
+        # 调度线程在此条件变量上等待（与 self.lock 共用同一把锁），只有新截止时间排到堆顶时才唤醒
+        self._cond = threading.Condition(self.lock)
+        
+        # Telegram 发送限速：全局令牌桶
+        self._tg_limiter = _RateLimiter(_TG_GLOBAL_RATE, _TG_GLOBAL_RATE)
+        
+        # 发送线程池，避免 TMDB/Telegram 请求阻塞调度
+        self._send_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='tg-send')
+        
+        # 单个调度线程负责所有聚合键的定时发送，取代每个聚合键一个 threading.Timer
+        self._scheduler = threading.Thread(target=self._scheduler_loop, name='aggregator-scheduler', daemon=True)
+        self._scheduler.start()
     
     def add_notification(self, data: Dict[str, Any], template_vars_override: Optional[Dict[str, Any]] = None) -> bool:
         """
@@ -68,22 +279,20 @@ class NotificationAggregator:
             data: Emby webhook 数据
         
         Returns:
-            是否成功添加
+            是否成功添加（Telegram 未配置时直接跳过，不视为失败）
         """
+        if not self._telegram_configured:
+            # 配置缺失已在创建时警告过，这里不再逐条记录警告
+            logger.debug("Telegram 未配置，跳过通知")
+            return True
+        
         try:
             # 解析数据（如果提供了覆盖的 template_vars，使用它）
+            # TMDB 图片和中文简介在发送前才获取（见 _enrich_with_tmdb），聚合中的每一集不单独请求
             if template_vars_override:
                 template_vars = template_vars_override
             else:
                 template_vars = self.parser.parse(data)
-                if template_vars:
-                    # 如果没有提供覆盖，尝试从 TMDB 获取中文简介
-                    image_url, overview_zh = self._get_tmdb_info(template_vars)
-                    if image_url:
-                        template_vars['_tmdb_image_url'] = image_url
-                    if overview_zh:
-                        template_vars['overview'] = overview_zh
-                        template_vars['overview_source'] = 'tmdb'
             
             if not template_vars:
                 return False
@@ -93,33 +302,25 @@ class NotificationAggregator:
             
             if is_episode:
                 # 剧集：需要聚合
-                return self._add_episode_notification(data, template_vars)
+                return self._add_episode_notification(template_vars)
             else:
                 # 电影：直接发送
-                return self._send_movie_notification(template_vars)
+                return self._send_single(template_vars)
         
         except Exception as e:
             logger.exception(f"添加通知时出错: {e}")
             return False
     
-    def _add_episode_notification(self, 
-                                   data: Dict[str, Any], 
-                                   template_vars: Dict[str, Any]) -> bool:
+    def _add_episode_notification(self, template_vars: Dict[str, Any]) -> bool:
         """添加剧集通知到聚合队列"""
         try:
-            # 提取剧集和季信息
-            # 使用反射调用静态方法
-            items = EmbyDataParser._extract_items(data)
-            if not items:
-                return False
-            
-            item = items[0].get('Item', {})
-            series_id = item.get('SeriesId')
-            season_id = item.get('SeasonId')
+            # 剧集和季 ID 已由解析器写入模板变量
+            series_id = template_vars.get('series_id')
+            season_id = template_vars.get('season_id')
             
             if not series_id or not season_id:
                 logger.warning("无法获取 SeriesId 或 SeasonId，直接发送通知")
-                return self._send_episode_notification(template_vars)
+                return self._send_single(template_vars)
             
             # 使用 (series_id, season_id) 作为聚合键
             # 这样可以确保：
@@ -132,65 +333,81 @@ class NotificationAggregator:
                 f"聚合键: {aggregation_key}, 剧名: {template_vars.get('title_year', 'Unknown')}"
             )
             
+            # 追加必须和发送线程取走 deque 在同一把锁下进行，否则追加到已取走的 deque 上的通知会丢失
             with self.lock:
+                pending = self.pending_notifications[aggregation_key]
+                
+                # 推迟该聚合键的发送时间
+                deadline = time.monotonic() + self.aggregation_delay
+                self._deadlines[aggregation_key] = deadline
+                heapq.heappush(self._heap, (deadline, aggregation_key))
+                # 新的截止时间早于调度线程当前等待的时间时，唤醒唯一的等待者
+                if self._heap[0][0] == deadline:
+                    self._cond.notify()
+                
                 # 添加到待聚合列表
-                self.pending_notifications[aggregation_key].append({
+                pending.append({
                     'template_vars': template_vars,
-                    'data': data,
-                    'timestamp': datetime.now()
+                    'sid': series_id,
+                    'eid': season_id
                 })
-                
-                # 如果已有定时器，取消它
-                if aggregation_key in self.timers:
-                    self.timers[aggregation_key].cancel()
-                
-                # 创建新的定时器
-                timer = threading.Timer(
-                    self.aggregation_delay,
-                    self._send_aggregated_notification,
-                    args=(aggregation_key,)
-                )
-                timer.start()
-                self.timers[aggregation_key] = timer
-                
-                logger.info(f"添加剧集通知到聚合队列: {aggregation_key}, 当前队列长度: {len(self.pending_notifications[aggregation_key])}")
+                queue_length = len(pending)
             
+            logger.info(f"添加剧集通知到聚合队列: {aggregation_key}, 当前队列长度: {queue_length}")
             return True
         
         except Exception as e:
             logger.exception(f"添加剧集通知时出错: {e}")
             return False
     
-    def _send_movie_notification(self, template_vars: Dict[str, Any]) -> bool:
-        """直接发送电影通知"""
-        try:
-            title, text = self.template_manager.render(template_vars)
-            photo_url = self._build_image_url(template_vars)
-            return self.telegram_client.send_message(title, text, photo_url=photo_url)
-        except Exception as e:
-            logger.exception(f"发送电影通知时出错: {e}")
-            return False
+    def _scheduler_loop(self):
+        """调度线程：等待最早的截止时间，到期后把聚合键交给发送线程池"""
+        while True:
+            ready = []
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    while self._heap and self._heap[0][0] <= now:
+                        deadline, key = heapq.heappop(self._heap)
+                        # 只处理最新的截止时间，被推迟的旧条目直接丢弃
+                        if self._deadlines.get(key) == deadline:
+                            del self._deadlines[key]
+                            ready.append(key)
+                    if ready:
+                        break
+                    # wait 会释放锁，期间加入的截止时间通过 notify 唤醒
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            
+            # 每个到期的聚合键单独提交，由发送线程池的空闲线程领取
+            for key in ready:
+                try:
+                    self._send_pool.submit(self._send_aggregated_notification, key)
+                except RuntimeError:
+                    # 线程池已关闭（程序退出中），直接在调度线程中发送
+                    self._send_aggregated_notification(key)
+    
+    def _send_message(self, title: str, text: str, photo_url: Optional[str] = None) -> bool:
+        """经过全局限速后发送 Telegram 消息"""
+        self._tg_limiter.acquire()
+        return self.telegram_client.send_message(title, text, photo_url=photo_url)
     
-    def _send_episode_notification(self, template_vars: Dict[str, Any]) -> bool:
-        """发送单集通知（用于无法聚合的情况）"""
+    def _send_single(self, template_vars: Dict[str, Any]) -> bool:
+        """发送单条通知（电影，或无法聚合的单集）"""
         try:
+            self._enrich_with_tmdb(template_vars)
             title, text = self.template_manager.render(template_vars)
-            photo_url = self._build_image_url(template_vars)
-            return self.telegram_client.send_message(title, text, photo_url=photo_url)
+            # _enrich_with_tmdb 之后图片 URL 一定已写入模板变量（可能为 None）
+            return self._send_message(title, text, photo_url=template_vars['_tmdb_image_url'])
         except Exception as e:
-            logger.exception(f"发送剧集通知时出错: {e}")
+            logger.exception(f"发送单条通知时出错: {e}")
             return False
     
     def _send_aggregated_notification(self, aggregation_key: str):
         """发送聚合通知"""
         try:
             with self.lock:
-                if aggregation_key not in self.pending_notifications:
-                    return
-                
-                notifications = self.pending_notifications.pop(aggregation_key, [])
-                if aggregation_key in self.timers:
-                    del self.timers[aggregation_key]
+                pending = self.pending_notifications.pop(aggregation_key, None)
+            notifications = list(pending) if pending else []
             
             if not notifications:
                 return
@@ -200,25 +417,21 @@ class NotificationAggregator:
                 # 如果不一致，分别发送
                 logger.warning(f"聚合键 {aggregation_key} 的通知不一致，分别发送")
                 for notif in notifications:
-                    template_vars = notif['template_vars']
-                    title, text = self.template_manager.render(template_vars)
-                    self.telegram_client.send_message(title, text)
+                    self._send_single(notif['template_vars'])
                 return
             
             # 如果只有一条，直接发送
             if len(notifications) == 1:
-                template_vars = notifications[0]['template_vars']
-                title, text = self.template_manager.render(template_vars)
-                photo_url = self._build_image_url(template_vars)
-                self.telegram_client.send_message(title, text, photo_url=photo_url)
+                self._send_single(notifications[0]['template_vars'])
                 logger.info(f"发送单集通知: {aggregation_key}")
                 return
             
-            # 多条：生成聚合通知
+            # 多条：生成聚合通知（图片和简介都使用第一条的 TMDB 信息）
+            self._enrich_with_tmdb(notifications[0]['template_vars'])
             aggregated_title, aggregated_text = self._create_aggregated_message(notifications)
             # 使用第一条的图片
-            photo_url = self._build_image_url(notifications[0]['template_vars'])
-            self.telegram_client.send_message(aggregated_title, aggregated_text, photo_url=photo_url)
+            photo_url = notifications[0]['template_vars']['_tmdb_image_url']
+            self._send_message(aggregated_title, aggregated_text, photo_url=photo_url)
             
             logger.info(f"发送聚合通知: {aggregation_key}, 共 {len(notifications)} 集")
         
@@ -241,45 +454,13 @@ class NotificationAggregator:
         if len(notifications) <= 1:
             return True
         
-        try:
-            # 提取第一条的 series_id 和 season_id
-            first_data = notifications[0].get('data', {})
-            first_items = EmbyDataParser._extract_items(first_data)
-            if not first_items:
-                return False
-            
-            first_item = first_items[0].get('Item', {})
-            expected_series_id = first_item.get('SeriesId')
-            expected_season_id = first_item.get('SeasonId')
-            
-            if not expected_series_id or not expected_season_id:
-                return False
-            
-            # 验证所有通知的 series_id 和 season_id 是否一致
-            for notif in notifications[1:]:
-                notif_data = notif.get('data', {})
-                notif_items = EmbyDataParser._extract_items(notif_data)
-                if not notif_items:
-                    logger.warning(f"通知数据格式异常，聚合键: {aggregation_key}")
-                    return False
-                
-                notif_item = notif_items[0].get('Item', {})
-                series_id = notif_item.get('SeriesId')
-                season_id = notif_item.get('SeasonId')
-                
-                if series_id != expected_series_id or season_id != expected_season_id:
-                    logger.error(
-                        f"聚合键 {aggregation_key} 包含不同剧集的通知！"
-                        f"期望: SeriesId={expected_series_id}, SeasonId={expected_season_id}, "
-                        f"实际: SeriesId={series_id}, SeasonId={season_id}"
-                    )
-                    return False
-            
-            return True
-        
-        except Exception as e:
-            logger.exception(f"验证通知一致性时出错: {e}")
+        # 入队时已记录每条通知的 series_id / season_id，这里直接比较，无需重新解析原始数据
+        ids = {(notif['sid'], notif['eid']) for notif in notifications}
+        if len(ids) != 1:
+            logger.error(f"聚合键 {aggregation_key} 包含不同剧集的通知！SeriesId/SeasonId: {sorted(ids)}")
             return False
+        
+        return True
     
     def _create_aggregated_message(self, notifications: List[Dict[str, Any]]) -> Tuple[str, str]:
         """
@@ -294,210 +475,142 @@ class NotificationAggregator:
         if not notifications:
             return "", ""
         
-        # 获取第一条通知作为基础信息
+        # 获取第一条通知作为基础信息，常用字段只读取一次
         first_vars = notifications[0]['template_vars']
+        get = first_vars.get
+        title_year = get('title_year', '')
+        tmdb_id = get('tmdb_id')
+        imdb_id = get('imdb_id')
+        douban_id = get('douban_id')
         
-        # 提取所有集数
+        # 一次遍历同时把集数解析为 (季, 集) 并累加原始字节数
         episodes = []
+        total_size = 0
         for notif in notifications:
-            season_episode = notif['template_vars'].get('season_episode')
+            tv = notif['template_vars']
+            season_episode = tv.get('season_episode')
             if season_episode:
-                episodes.append(season_episode)
+                # 格式: S01E02（由解析器生成）
+                season, _, episode = season_episode[1:].partition('E')
+                if season.isdigit() and episode.isdigit():
+                    episodes.append((int(season), int(episode)))
+            total_size += tv.get('_raw_size_bytes', 0)
         
-        # 排序集数
+        # 按季和集排序后合并连续集数
         episodes.sort()
-        
-        # 生成集数范围字符串
-        if len(episodes) == 1:
-            episode_str = episodes[0]
-        else:
-            # 尝试合并连续集数
-            episode_ranges = self._merge_episode_ranges(episodes)
-            episode_str = ', '.join(episode_ranges)
+        episode_str = ', '.join(self._merge_episode_ranges(episodes))
         
         # 构建标题
-        title_year = first_vars.get('title_year', '')
         title = f"🎬 {title_year} {episode_str} 已入库（共 {len(notifications)} 集）"
         
         # 构建正文
         # 使用第一条的详细信息，但更新集数和文件信息
-        total_size = 0
         total_files = len(notifications)
-        
-        # 计算总大小
-        for notif in notifications:
-            size_str = notif['template_vars'].get('total_size', '')
-            if size_str:
-                # 简单解析大小（这里可以改进）
-                try:
-                    size_value, size_unit = size_str.split()
-                    size_value = float(size_value)
-                    if size_unit == 'GB':
-                        total_size += size_value * 1024 * 1024 * 1024
-                    elif size_unit == 'MB':
-                        total_size += size_value * 1024 * 1024
-                    elif size_unit == 'KB':
-                        total_size += size_value * 1024
-                    else:
-                        total_size += size_value
-                except:
-                    pass
-        
-        from utils import format_size
-        total_size_str = format_size(int(total_size)) if total_size > 0 else None
+        total_size_str = format_size(total_size) if total_size > 0 else None
         
         # 构建聚合消息正文
         text_parts = [
             "📢 媒体库：Emby",
         ]
+        append = text_parts.append
         
         # 评分
-        vote_average = first_vars.get('vote_average')
+        vote_average = get('vote_average')
         if vote_average:
-            text_parts.append(f"⭐️ 评分：{vote_average}/10")
+            append(f"⭐️ 评分：{vote_average}/10")
         
         # 媒体类型
-        text_parts.append("📺 媒体类型：剧集")
+        append("📺 媒体类型：剧集")
         
         # 归类
-        category = first_vars.get('category')
+        category = get('category')
         if category:
-            text_parts.append(f"🏷 归类：{category}")
-        
-        # 质量（使用第一条的质量信息）
-        res_label = ""
-        hdr_text = ""
-        # 这里可以改进，合并所有集的质量信息
-        resource_quality = first_vars.get('resource_quality', '')
-        video_width = first_vars.get('video_width', 0)
-        video_height = first_vars.get('video_height', 0)
-        
-        if video_width >= 3800 or video_height >= 2000:
-            res_label = '2160p (4K)'
-        elif video_width >= 1900 or video_height >= 1000:
-            res_label = '1080p'
-        elif video_width >= 1200 or video_height >= 700:
-            res_label = '720p'
-        
-        if resource_quality:
-            rq_lower = resource_quality.lower()
-            hdrs = []
-            if 'hdr' in rq_lower and 'dv' not in rq_lower:
-                hdrs.append('HDR10')
-            if 'dolby vision' in rq_lower or 'dv' in rq_lower:
-                hdrs.append('Dolby Vision')
-            if 'imax' in rq_lower:
-                hdrs.append('IMAX')
-            hdr_text = '｜'.join(hdrs)
+            append(f"🏷 归类：{category}")
+        
+        # 质量（使用第一条的质量信息，标签已在解析时计算好）
+        res_label = get('resolution_label', '')
+        hdr_text = get('hdr_label', '')
         
         if res_label or hdr_text:
             quality_str = res_label
             if hdr_text:
                 quality_str = f"{quality_str}｜{hdr_text}" if quality_str else hdr_text
-            text_parts.append(f"🖼 质量：{quality_str}")
+            append(f"🖼 质量：{quality_str}")
         
         # 文件信息
-        text_parts.append(f"📂 文件：{total_files} 个")
+        append(f"📂 文件：{total_files} 个")
         
         if total_size_str:
-            text_parts.append(f"💾 总大小：{total_size_str}")
+            append(f"💾 总大小：{total_size_str}")
         
         # TMDB ID
-        tmdb_id = first_vars.get('tmdb_id')
         if tmdb_id:
-            text_parts.append(f"🍿 TMDB ID：{tmdb_id}")
+            append(f"🍿 TMDB ID：{tmdb_id}")
         
         # 简介（使用第一条）
-        overview = first_vars.get('overview')
+        overview = get('overview')
         if overview:
             overview_short = overview[:160] + ('…' if len(overview) > 160 else '')
-            text_parts.append(f"\n📝 简介：{overview_short}")
+            append(f"\n📝 简介：{overview_short}")
         
         # 链接
         links = []
         if tmdb_id:
             links.append(f"🔗 [TMDB](https://www.themoviedb.org/tv/{tmdb_id})")
         
-        imdb_id = first_vars.get('imdb_id')
-        douban_id = first_vars.get('douban_id')
-        title_year = first_vars.get('title_year', '')
-        
         if douban_id:
             links.append(f"🎬 [豆瓣](https://movie.douban.com/subject/{douban_id}/)")
         elif imdb_id:
             links.append(f"🎬 [豆瓣](https://www.douban.com/search?cat=1002&q={imdb_id})")
         elif title_year:
-            from urllib.parse import quote
             links.append(f"🎬 [豆瓣](https://www.douban.com/search?cat=1002&q={quote(title_year)})")
         
         if imdb_id:
             links.append(f"🌟 [IMDb](https://www.imdb.com/title/{imdb_id}/)")
         
         if links:
-            text_parts.append("\n🌐 链接：")
-            text_parts.append(' | '.join(links))
+            append("\n🌐 链接：\n" + ' | '.join(links))
         
         text = '\n'.join(text_parts)
         
         return title, text
     
-    def _merge_episode_ranges(self, episodes: List[str]) -> List[str]:
+    def _merge_episode_ranges(self, episodes: List[Tuple[int, int]]) -> Iterator[str]:
         """
-        合并连续的集数范围
+        合并连续的集数范围（生成器，逐个产出范围字符串）
+        
+        例如: [(1, 1), (1, 2), (1, 3), (1, 5)] -> 'S01E01-E03', 'S01E05'
         
-        例如: ['S01E01', 'S01E02', 'S01E03', 'S01E05'] -> ['S01E01-E03', 'S01E05']
+        Args:
+            episodes: 已按季和集排序的 (季, 集) 列表
         """
         if not episodes:
-            return []
-        
-        # 解析集数
-        parsed = []
-        for ep in episodes:
-            try:
-                # 格式: S01E02
-                parts = ep.split('E')
-                season = int(parts[0][1:])
-                episode = int(parts[1])
-                parsed.append((season, episode, ep))
-            except:
-                parsed.append((0, 0, ep))
-        
-        # 按季和集排序
-        parsed.sort()
+            return
         
         # 合并连续集数
-        ranges = []
-        current_range_start = None
-        current_range_end = None
-        current_season = None
-        
-        for season, episode, ep_str in parsed:
-            if current_range_start is None:
-                current_range_start = episode
-                current_range_end = episode
-                current_season = season
-            elif season == current_season and episode == current_range_end + 1:
+        current_season, current_range_start = episodes[0]
+        current_range_end = current_range_start
+        
+        for season, episode in episodes[1:]:
+            if season == current_season and episode == current_range_end + 1:
                 # 连续，扩展范围
                 current_range_end = episode
-            else:
-                # 不连续，保存当前范围，开始新范围
-                if current_range_start == current_range_end:
-                    ranges.append(f"S{current_season:02d}E{current_range_start:02d}")
-                else:
-                    ranges.append(f"S{current_season:02d}E{current_range_start:02d}-E{current_range_end:02d}")
-                
-                current_range_start = episode
-                current_range_end = episode
-                current_season = season
-        
-        # 保存最后一个范围
-        if current_range_start is not None:
+                continue
+            
+            # 不连续，产出当前范围，开始新范围
             if current_range_start == current_range_end:
-                ranges.append(f"S{current_season:02d}E{current_range_start:02d}")
+                yield f"S{current_season:02d}E{current_range_start:02d}"
             else:
-                ranges.append(f"S{current_season:02d}E{current_range_start:02d}-E{current_range_end:02d}")
+                yield f"S{current_season:02d}E{current_range_start:02d}-E{current_range_end:02d}"
+            
+            current_season = season
+            current_range_start = current_range_end = episode
         
-        return ranges
+        # 产出最后一个范围
+        if current_range_start == current_range_end:
+            yield f"S{current_season:02d}E{current_range_start:02d}"
+        else:
+            yield f"S{current_season:02d}E{current_range_start:02d}-E{current_range_end:02d}"
     
     def _get_tmdb_info(self, template_vars: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
         """
@@ -520,7 +633,7 @@ class NotificationAggregator:
             year = None
             if '(' in title_year and ')' in title_year:
                 # 尝试提取年份
-                match = re.search(r'\((\d{4})\)', title_year)
+                match = _YEAR_RE.search(title_year)
                 if match:
                     year = int(match.group(1))
                     title = title_year[:title_year.rfind('(')].strip()
@@ -543,7 +656,7 @@ class NotificationAggregator:
         if not tmdb_id:
             return None, None
         
-        media_type = template_vars.get('media_type', 'movie')
+        media_type = template_vars.get('media_type', 'movie')  # 'tv' 或 'movie'
         
         # 检查是否配置了 API Key
         api_key = Config.TMDB_API_KEY
@@ -551,66 +664,85 @@ class NotificationAggregator:
             logger.debug("TMDB_API_KEY 未配置，跳过图片和简介获取")
             return None, None
         
-        try:
-            api_url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}?api_key={api_key}&language=zh-CN"
-            
-            logger.debug(f"正在从 TMDB 获取信息: {media_type}/{tmdb_id}")
-            response = requests.get(api_url, timeout=5)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # 获取图片 URL
-                image_url = None
-                poster_path = data.get('poster_path')
-                if poster_path:
-                    base_url = Config.TMDB_IMAGE_BASE_URL.rstrip('/')
-                    image_url = f"{base_url}{poster_path}"
-                    logger.debug(f"获取到 TMDB 图片: {image_url}")
-                else:
-                    logger.debug("TMDB 数据中没有 poster_path")
-                
-                # 获取中文简介（必须是中文，如果没有中文简介则不使用）
-                overview_zh = data.get('overview')
-                if overview_zh:
-                    logger.debug(f"获取到 TMDB 中文简介: {overview_zh[:50]}...")
-                else:
-                    logger.debug("TMDB 数据中没有中文简介")
-                
+        # 优先使用缓存：未过期直接返回；过期但未超过 2 倍 TTL 时先返回旧值，后台刷新
+        # Emby 提供的 ID 是字符串，find_tmdb_id 返回整数，统一转成字符串，保证同一部剧共用一个缓存项
+        cache_key = (media_type, str(tmdb_id), 'zh-CN')
+        entry = _tmdb_cache_get(cache_key)
+        if entry is not None:
+            fetched_at, image_url, overview_zh, _ = entry
+            age = time.monotonic() - fetched_at
+            ttl = Config.TMDB_CACHE_TTL
+            if age <= ttl:
                 return image_url, overview_zh
-            else:
-                logger.warning(f"TMDB API 返回错误状态码: {response.status_code}, 响应: {response.text[:200]}")
-        except Exception as e:
-            logger.warning(f"从 TMDB 获取信息失败: {e}")
+            if age <= 2 * ttl:
+                _schedule_tmdb_refresh(cache_key)
+                return image_url, overview_zh
+        
+        # 同一个键同时只发起一次请求，其余线程等待该请求的结果
+        with _tmdb_inflight_lock:
+            future = _tmdb_inflight.get(cache_key)
+            is_owner = future is None
+            if is_owner:
+                future = _tmdb_inflight[cache_key] = Future()
+        
+        if not is_owner:
+            try:
+                # 等待时间覆盖请求方最坏情况下的耗时，避免请求方稍后成功而这里已放弃
+                result = future.result(timeout=_TMDB_FETCH_BUDGET + 1)
+            except Exception as e:
+                logger.warning(f"等待 TMDB 请求结果失败: {e}")
+                result = None
+            return result if result is not None else (None, None)
         
-        return None, None
+        try:
+            fetched = _fetch_tmdb_details(media_type, tmdb_id)
+            result = None
+            if isinstance(fetched, tuple):
+                _tmdb_cache_put(cache_key, *fetched)
+                result = fetched[:2]
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with _tmdb_inflight_lock:
+                _tmdb_inflight.pop(cache_key, None)
+        
+        return result if result is not None else (None, None)
     
-    def _build_image_url(self, template_vars: Dict[str, Any]) -> Optional[str]:
+    def _enrich_with_tmdb(self, template_vars: Dict[str, Any]):
         """
-        从 TMDB 获取图片 URL（兼容接口）
+        发送前从 TMDB 获取图片和中文简介并写入模板变量（每条通知只获取一次）
         
         Args:
             template_vars: 模板变量字典
-        
-        Returns:
-            图片 URL 或 None
         """
-        # 如果已经有缓存的图片 URL，直接返回
         if '_tmdb_image_url' in template_vars:
-            return template_vars['_tmdb_image_url']
-        
-        # 否则调用 API 获取
-        image_url, _ = self._get_tmdb_info(template_vars)
-        return image_url
+            return
+        
+        image_url, overview_zh = self._get_tmdb_info(template_vars)
+        # 即使没有图片也记录下来，避免同一条通知再次请求
+        template_vars['_tmdb_image_url'] = image_url
+        if overview_zh:
+            template_vars['overview'] = overview_zh
+            template_vars['overview_source'] = 'tmdb'
     
     def flush_all(self):
         """立即发送所有待聚合的通知（用于程序关闭时）"""
         with self.lock:
             keys = list(self.pending_notifications.keys())
-            for key in keys:
-                # 取消定时器
-                if key in self.timers:
-                    self.timers[key].cancel()
-                # 立即发送
+            # 清空调度，避免调度线程重复发送
+            self._deadlines.clear()
+            self._heap.clear()
+        
+        # 交给发送线程池并发发送；线程池已关闭（解释器退出中）时在当前线程中直接发送
+        futures = []
+        for key in keys:
+            try:
+                futures.append(self._send_pool.submit(self._send_aggregated_notification, key))
+            except RuntimeError:
                 self._send_aggregated_notification(key)
+        
+        # 只等待本次提交的发送完成，不关闭线程池（调度线程仍可能继续使用）
+        wait(futures)
 
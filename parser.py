@@ -4,8 +4,17 @@
 Emby 数据解析模块
 """
 
+import logging
+import re
 from typing import Dict, Any, Optional
-from utils import format_size, extract_quality_from_filename
+from utils import format_size, extract_quality_from_filename, as_int, format_hdr_label, format_resolution_label
+
+logger = logging.getLogger(__name__)
+
+# 纯集名称（以"第"开头、或"Episode"开头、或纯数字），模块加载时编译一次
+_EPISODE_NAME_ONLY_RE = re.compile(r'^(第\s*\d+\s*集|Episode\s+\d+|\d+)$', re.IGNORECASE)
+# 纯集名称可能的首字符（正则忽略大小写，需同时包含 E 和 e；数字另用 isdecimal 判断，与 \d 一致）
+_EPISODE_NAME_ONLY_FIRST_CHARS = frozenset('第Ee')
 
 
 class EmbyDataParser:
@@ -33,38 +42,38 @@ class EmbyDataParser:
         
         # 提取 Item 对象
         item = item_data.get('Item', {})
+        get = item.get
         server = item_data.get('Server', {})
         
         # 媒体类型
-        item_type = item.get('Type', '')
+        item_type = get('Type', '')
         is_episode = item_type == 'Episode'
         
         # 基本信息
         # 对于剧集，使用 SeriesName；对于电影，使用 Name
         if is_episode:
-            series_name = item.get('SeriesName', '')
-            episode_name = item.get('Name', '')
+            series_name = get('SeriesName', '')
+            episode_name = get('Name', '')
             
             # 优先使用 SeriesName，如果为空则使用 Name
             name = series_name or episode_name
             
             # 如果只有单集名称（通常以"第"、"Episode"等开头），记录警告
             if not series_name and episode_name:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.warning(f"剧集缺少 SeriesName，仅使用 Name: {episode_name}")
         else:
-            name = item.get('Name', '')
+            name = get('Name', '')
         
-        production_year = item.get('ProductionYear', 0)
+        production_year = get('ProductionYear', 0)
         
         # 对于剧集，如果名称看起来像是单集名称（如"第1集"、"Episode 2"），不添加年份
         # 因为这说明 SeriesName 缺失，添加年份会很奇怪
         is_episode_name_only = False
         if is_episode and name:
             # 检查是否是纯集名称（以"第"开头、或"Episode"开头、或纯数字）
-            import re
-            if re.match(r'^(第\s*\d+\s*集|Episode\s+\d+|\d+)$', name.strip(), re.IGNORECASE):
+            # 先用首字符快速排除绝大多数正常剧名，再做正则匹配
+            stripped = name.strip()
+            if stripped and (stripped[0] in _EPISODE_NAME_ONLY_FIRST_CHARS or stripped[0].isdecimal()) and _EPISODE_NAME_ONLY_RE.match(stripped):
                 is_episode_name_only = True
         
         # 如果名称中已经包含年份（格式如 "剧名 (YYYY)"），则不重复添加
@@ -78,7 +87,7 @@ class EmbyDataParser:
         season_episode, season_fmt = EmbyDataParser._extract_season_info(item, is_episode)
         
         # Provider IDs
-        provider_ids = item.get('ProviderIds', {})
+        provider_ids = get('ProviderIds') or {}
         tmdb_id = provider_ids.get('Tmdb') or provider_ids.get('MovieDb')
         imdb_id = provider_ids.get('Imdb')
         douban_id = None  # Emby 通常不提供豆瓣 ID
@@ -87,33 +96,40 @@ class EmbyDataParser:
         vote_average = EmbyDataParser._extract_rating(item)
         
         # 类型/分类
-        genres = item.get('Genres', [])
+        genres = get('Genres')
         category = ' / '.join(genres) if genres else None
         
         # 文件信息
-        filename = item.get('FileName', '')
-        file_path = item.get('Path', '')
+        filename = get('FileName', '')
+        file_path = get('Path', '')
         resource_quality = extract_quality_from_filename(filename) or extract_quality_from_filename(file_path)
         
         # 视频尺寸
-        video_width = item.get('Width', 0)
-        video_height = item.get('Height', 0)
+        video_width = as_int(get('Width', 0))
+        video_height = as_int(get('Height', 0))
+        
+        # 分辨率和 HDR 标签，解析时计算一次（与模板使用相同的规则），聚合消息直接使用
+        rq_lower = resource_quality.lower() if resource_quality else ''
+        resolution_label = format_resolution_label(video_width, video_height, rq_lower)
+        hdr_label = format_hdr_label(rq_lower)
         
         # 文件大小
-        file_size = item.get('Size', 0)
+        file_size = get('Size', 0)
         total_size = format_size(file_size) if file_size else None
         
         # 文件数量（单个文件）
         file_count = 1
         
         # 简介
-        overview = item.get('Overview') or item_data.get('Description', '')
+        overview = get('Overview') or item_data.get('Description', '')
         
         # 图片信息
-        image_tags = item.get('ImageTags', {})
+        image_tags = get('ImageTags') or {}
         primary_image_tag = image_tags.get('Primary')
-        item_id = item.get('Id')
-        series_id_for_image = item.get('SeriesId') if is_episode else None
+        item_id = get('Id')
+        series_id_for_image = get('SeriesId') if is_episode else None
+        # 剧集的季 ID，与 series_id 一起作为聚合键
+        season_id = get('SeasonId') if is_episode else None
         
         # 构建模板变量字典
         template_vars = {
@@ -136,13 +152,17 @@ class EmbyDataParser:
             'resource_quality': resource_quality,
             'video_width': video_width,
             'video_height': video_height,
+            'resolution_label': resolution_label,
+            'hdr_label': hdr_label,
             'file_count': file_count,
             'total_size': total_size,
+            '_raw_size_bytes': int(file_size or 0),  # 原始字节数，供聚合时直接累加
             'overview': overview,
             'overview_source': 'emby',  # 标记简介来源
             'item_id': item_id,
             'primary_image_tag': primary_image_tag,
             'series_id': series_id_for_image,
+            'season_id': season_id,
         }
         
         return template_vars
@@ -150,15 +170,16 @@ class EmbyDataParser:
     @staticmethod
     def _extract_items(data: Dict[str, Any]) -> list:
         """从数据中提取项目列表"""
-        if 'tv' in data:
-            return data['tv']
-        elif 'mv' in data:
-            return data['mv']
-        elif isinstance(data, list):
+        # 列表格式没有 get 方法，先用类型判断排除（type() is 比 isinstance 更快）
+        if type(data) is list:
             return data
-        else:
-            # 单个对象格式
-            return [data]
+        # 只要包含 tv/mv 键就按包装格式处理（值为 null 时视为空列表）
+        if 'tv' in data:
+            return data['tv'] or []
+        if 'mv' in data:
+            return data['mv'] or []
+        # 单个对象格式
+        return [data]
     
     @staticmethod
     def _extract_season_info(item: Dict[str, Any], is_episode: bool) -> tuple[Optional[str], Optional[str]]:
@@ -4,29 +4,59 @@
 Telegram 客户端模块
 """
 
+import atexit
 import logging
 from typing import Optional
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Telegram 请求重试策略：429/5xx 和连接失败按指数退避重试（依次等待 0s、2s、4s）；
+# 不遵循 Retry-After（限流时可能长达数百秒，会长时间占住发送线程、拖住退出时的 flush_all）；
+# 读取超时不重试（消息可能已送达，重试会重复发送），其他 4xx 直接失败
+_TELEGRAM_RETRY = Retry(
+    total=3,
+    read=0,
+    backoff_factor=1.0,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=['POST'],
+    respect_retry_after_header=False,
+    raise_on_status=False,
+)
+
 
 class TelegramClient:
     """Telegram Bot 客户端"""
     
-    def __init__(self, bot_token: Optional[str] = None, chat_id: Optional[str] = None):
+    def __init__(self, bot_token: Optional[str] = None, chat_id: Optional[str] = None,
+                 session: Optional[requests.Session] = None):
         """
         初始化 Telegram 客户端
         
         Args:
             bot_token: Telegram Bot Token，如果为 None 则从 Config 读取
             chat_id: Telegram Chat ID，如果为 None 则从 Config 读取
+            session: 复用的 HTTP 会话，如果为 None 则自动创建
         """
         self.bot_token = bot_token or Config.TELEGRAM_BOT_TOKEN
         self.chat_id = chat_id or Config.TELEGRAM_CHAT_ID
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        
+        # 所有请求复用同一个会话，保持与 api.telegram.org 的 keep-alive 连接
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=8, max_retries=_TELEGRAM_RETRY))
+        session.headers['Connection'] = 'keep-alive'
+        self.session = session
+        atexit.register(self.close)
+    
+    def close(self):
+        """关闭 HTTP 会话，释放连接"""
+        self.session.close()
     
     def send_photo(self, photo_url: str, caption: str = '', parse_mode: str = 'Markdown') -> bool:
         """
@@ -54,7 +84,7 @@ class TelegramClient:
         }
         
         try:
-            response = requests.post(url, json=payload, timeout=15)
+            response = self.session.post(url, json=payload, timeout=(3, 15))
             response.raise_for_status()
             logger.info("图片已发送到 Telegram")
             return True
@@ -103,7 +133,7 @@ class TelegramClient:
         }
         
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = self.session.post(url, json=payload, timeout=(3, 10))
             response.raise_for_status()
             logger.info(f"消息已发送到 Telegram: {title[:50]}...")
             return True
@@ -4,61 +4,28 @@
 消息模板管理模块
 """
 
-from jinja2 import Template, Environment, BaseLoader
+import logging
+from typing import Optional
+from jinja2 import Template, Environment, DictLoader, FileSystemBytecodeCache
 from urllib.parse import quote
 
+from config import Config
+from utils import as_int, format_hdr_label, format_resolution_label
 
-class TemplateManager:
-    """模板管理器"""
-    
-    def __init__(self):
-        """初始化模板管理器"""
-        # 创建 Jinja2 环境并添加 urlencode 过滤器
-        self.env = Environment(loader=BaseLoader())
-        self.env.filters['urlencode'] = lambda u: quote(str(u), safe='')
-        
-        # 初始化模板
-        self.title_template = self._create_title_template()
-        self.text_template = self._create_text_template()
-    
-    def _create_title_template(self) -> Template:
-        """创建标题模板"""
-        template_str = (
-            "🎬 {{ title_year }}"
-            "{% if season_episode %} {{ season_episode }}"
-            "{% elif season_fmt %} {{ season_fmt }}"
-            "{% endif %} 已入库"
-        )
-        return self.env.from_string(template_str)
-    
-    def _create_text_template(self) -> Template:
-        """创建正文模板"""
-        template_str = """{% set tmdb_actual = tmdbid|default(tmdb_id, true) %}
-{% set imdb_actual = imdbid|default(imdb_id, true) %}
-{% set douban_actual = doubanid|default(douban_id, true) %}
-{# 直接使用 media_type，它已经基于 Emby 的 Type 字段正确设置（'tv' 或 'movie'） #}
-{% set mt_raw = media_type|default(type, true)|default('', true) %}
-{# 作为后备，如果有季集信息则肯定是剧集 #}
-{% set is_tv = (mt_raw|string)|lower in ['tv','电视剧','剧集','television','episode'] or (season_fmt or season_episode) %}
-{% set mt_label = '剧集' if is_tv else '电影' %}
-{% set mt_type = 'tv' if is_tv else 'movie' %}
-{% set rq_input = resource_term|default(resource_quality, true)|default('', true) %}
-{% set rq_lower = rq_input|lower %}
-{% set vw = (video_width|default(0))|int %}
-{% set vh = (video_height|default(0))|int %}
-{% if vw >= 3800 or vh >= 2000 %}{% set res_label = '2160p (4K)' %}
-{% elif vw >= 1900 or vh >= 1000 %}{% set res_label = '1080p' %}
-{% elif vw >= 1200 or vh >= 700 %}{% set res_label = '720p' %}
-{% elif '4k' in rq_lower or '2160p' in rq_lower %}{% set res_label = '2160p (4K)' %}
-{% elif '1080p' in rq_lower %}{% set res_label = '1080p' %}
-{% elif '720p' in rq_lower %}{% set res_label = '720p' %}
-{% else %}{% set res_label = '' %}{% endif %}
-{% set hdrs = [] %}
-{% if 'hdr' in rq_lower and not ('dv' in rq_lower) %}{% set _ = hdrs.append('HDR10') %}{% endif %}
-{% if 'dolby vision' in rq_lower or 'dv' in rq_lower %}{% set _ = hdrs.append('Dolby Vision') %}{% endif %}
-{% if 'imax' in rq_lower %}{% set _ = hdrs.append('IMAX') %}{% endif %}
-{% set hdr_text = '｜'.join(hdrs) %}
-📢 媒体库：Emby
+logger = logging.getLogger(__name__)
+
+
+# 标题模板
+_TITLE_SRC = (
+    "🎬 {{ title_year }}"
+    "{% if season_episode %} {{ season_episode }}"
+    "{% elif season_fmt %} {{ season_fmt }}"
+    "{% endif %} 已入库"
+)
+
+# 正文模板
+# tmdb_actual / mt_label / res_label / hdr_text 等派生变量由 _resolve_vars 在 Python 中预先计算，模板中只做替换
+_TEXT_SRC = """📢 媒体库：Emby
 {% if vote_average %}⭐️ 评分：{{ vote_average }}/10
 {% endif %}
 {{ '📺' if mt_label == '剧集' else '🎦' }} 媒体类型：{{ mt_label }}
@@ -83,8 +50,165 @@ class TemplateManager:
 {% if links %}
 
 🌐 链接：{{ links | join(' | ') }}{% endif %}"""
+
+# Jinja2 环境和编译后的模板在模块加载时创建一次，所有 TemplateManager 实例共用
+# 模板通过 DictLoader 加载（from_string 不会使用字节码缓存），编译结果写入字节码缓存，进程重启后直接复用
+_ENV = Environment(loader=DictLoader({'title': _TITLE_SRC, 'text': _TEXT_SRC}))
+_ENV.filters['urlencode'] = lambda u: quote(str(u), safe='')
+try:
+    _ENV.bytecode_cache = FileSystemBytecodeCache(Config.JINJA_CACHE_DIR or None)
+    _TITLE_TEMPLATE = _ENV.get_template('title')
+    _TEXT_TEMPLATE = _ENV.get_template('text')
+except (OSError, RuntimeError) as e:
+    # 缓存目录不可用（如只读文件系统）时不使用缓存
+    logger.warning(f"Jinja2 字节码缓存不可用，每次启动将重新编译模板: {e}")
+    _ENV.bytecode_cache = None
+    _TITLE_TEMPLATE = _ENV.get_template('title')
+    _TEXT_TEMPLATE = _ENV.get_template('text')
+
+
+# 这些媒体类型视为剧集（与正文模板中的判断一致）
+_TV_MEDIA_TYPES = frozenset(['tv', '电视剧', '剧集', 'television', 'episode'])
+
+
+def _resolve_vars(template_vars: dict) -> dict:
+    """
+    计算模板中需要回退或判断得出的派生变量
+    
+    Args:
+        template_vars: 模板变量字典
+    
+    Returns:
+        派生变量字典：tmdb_actual、imdb_actual、douban_actual、is_tv、mt_label、mt_type、res_label、hdr_text
+    """
+    get = template_vars.get
+    
+    tmdb_actual = get('tmdbid') or get('tmdb_id')
+    imdb_actual = get('imdbid') or get('imdb_id')
+    douban_actual = get('doubanid') or get('douban_id')
+    
+    # 直接使用 media_type，作为后备，如果有季集信息则肯定是剧集
+    mt_raw = get('media_type') or get('type') or ''
+    is_tv = str(mt_raw).lower() in _TV_MEDIA_TYPES or bool(get('season_fmt') or get('season_episode'))
+    
+    # 分辨率：优先根据视频尺寸判断，其次根据文件名中的画质信息
+    rq_lower = (get('resource_term') or get('resource_quality') or '').lower()
+    res_label = format_resolution_label(as_int(get('video_width', 0)), as_int(get('video_height', 0)), rq_lower)
+    hdr_text = format_hdr_label(rq_lower)
+    
+    return {
+        'tmdb_actual': tmdb_actual,
+        'imdb_actual': imdb_actual,
+        'douban_actual': douban_actual,
+        'is_tv': is_tv,
+        'mt_label': '剧集' if is_tv else '电影',
+        'mt_type': 'tv' if is_tv else 'movie',
+        'res_label': res_label,
+        'hdr_text': hdr_text,
+    }
+
+
+def build_message(template_vars: dict) -> tuple[str, str]:
+    """
+    直接用 Python 生成通知标题和正文，逻辑与 Jinja2 模板相同，但没有模板引擎的开销
+    
+    模板中 {% set %} 等标签留下的多余空行不会输出，版式与 README 中的示例一致
+    
+    Args:
+        template_vars: 模板变量字典
+    
+    Returns:
+        (title, text) 元组
+    """
+    get = template_vars.get
+    
+    # 标题
+    title_year = get('title_year', '')
+    season_episode = get('season_episode')
+    season_fmt = get('season_fmt')
+    if season_episode:
+        title = f"🎬 {title_year} {season_episode} 已入库"
+    elif season_fmt:
+        title = f"🎬 {title_year} {season_fmt} 已入库"
+    else:
+        title = f"🎬 {title_year} 已入库"
+    
+    resolved = _resolve_vars(template_vars)
+    tmdb_actual = resolved['tmdb_actual']
+    imdb_actual = resolved['imdb_actual']
+    douban_actual = resolved['douban_actual']
+    is_tv = resolved['is_tv']
+    res_label = resolved['res_label']
+    hdr_text = resolved['hdr_text']
+    
+    # 正文
+    parts = ["📢 媒体库：Emby"]
+    append = parts.append
+    
+    vote_average = get('vote_average')
+    if vote_average:
+        append(f"⭐️ 评分：{vote_average}/10")
+    
+    append("📺 媒体类型：剧集" if is_tv else "🎦 媒体类型：电影")
+    
+    category = get('category')
+    if category:
+        append(f"🏷 归类：{category}")
+    
+    if res_label or hdr_text:
+        if hdr_text:
+            append(f"🖼 质量：{res_label}｜{hdr_text}")
+        else:
+            append(f"🖼 质量：{res_label}")
+    
+    file_count = get('file_count')
+    if file_count:
+        append(f"📂 文件：{file_count} 个")
+    
+    total_size = get('total_size')
+    if total_size:
+        append(f"💾 大小：{total_size}")
+    
+    if tmdb_actual:
+        append(f"🍿 TMDB ID：{tmdb_actual}")
+    
+    overview = get('overview')
+    if overview:
+        append(f"\n📝 简介：{overview[:160]}{'…' if len(overview) > 160 else ''}")
+    
+    # 链接
+    links = []
+    if tmdb_actual:
+        links.append(f"🔗 [TMDB](https://www.themoviedb.org/{'tv' if is_tv else 'movie'}/{tmdb_actual})")
+    if douban_actual:
+        links.append(f"🎬 [豆瓣](https://movie.douban.com/subject/{douban_actual}/)")
+    elif imdb_actual:
+        links.append(f"🎬 [豆瓣](https://www.douban.com/search?cat=1002&q={imdb_actual})")
+    elif title_year:
+        links.append(f"🎬 [豆瓣](https://www.douban.com/search?cat=1002&q={quote(str(title_year), safe='')})")
+    if imdb_actual:
+        links.append(f"🌟 [IMDb](https://www.imdb.com/title/{imdb_actual}/)")
+    if links:
+        append("\n🌐 链接：" + ' | '.join(links))
+    
+    return title, '\n'.join(parts)
+
+
+class TemplateManager:
+    """模板管理器"""
+    
+    def __init__(self, use_jinja: Optional[bool] = None):
+        """
+        初始化模板管理器
         
-        return self.env.from_string(template_str)
+        Args:
+            use_jinja: 是否使用 Jinja2 模板渲染，如果为 None 则从 Config 读取（默认使用 build_message）
+        """
+        self.use_jinja = Config.USE_JINJA_TEMPLATES if use_jinja is None else use_jinja
+        # 复用模块级的 Jinja2 环境和已编译模板，实例化时不再重新编译
+        self.env = _ENV
+        self.title_template: Template = _TITLE_TEMPLATE
+        self.text_template: Template = _TEXT_TEMPLATE
     
     def render(self, template_vars: dict) -> tuple[str, str]:
         """
@@ -96,7 +220,10 @@ class TemplateManager:
         Returns:
             (title, text) 元组
         """
+        if not self.use_jinja:
+            return build_message(template_vars)
+        
         title = self.title_template.render(**template_vars)
-        text = self.text_template.render(**template_vars)
+        text = self.text_template.render({**template_vars, **_resolve_vars(template_vars)})
         return title, text
 
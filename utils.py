@@ -5,13 +5,47 @@
 """
 
 import re
+import time
 import logging
+import functools
 from typing import Optional, Tuple
-from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+# 画质匹配规则合并为一个正则，只扫描一次文件名；命名分组按输出顺序对应画质标签
+_QUALITY_RE = re.compile(
+    r'(?P<uhd>2160p|4k)|(?P<fhd>1080p)|(?P<hd>720p)|(?P<hdr>hdr(?!10))|(?P<dv>dolby.?vision|dv)|(?P<imax>imax)',
+    re.IGNORECASE,
+)
+_QUALITY_LABELS = (
+    ('uhd', '2160p (4K)'),
+    ('fhd', '1080p'),
+    ('hd', '720p'),
+    ('hdr', 'HDR'),
+    ('dv', 'Dolby Vision'),
+    ('imax', 'IMAX'),
+)
+
+# HDR 标签组合表，下标为 format_hdr_label 计算的位标志：1 = HDR10，2 = Dolby Vision，4 = IMAX
+_HDR_LABELS = tuple(
+    '｜'.join(label for bit, label in ((1, 'HDR10'), (2, 'Dolby Vision'), (4, 'IMAX')) if flags & bit)
+    for flags in range(8)
+)
+
+# TMDB ID 查找复用同一个 Session（keep-alive），429/5xx 自动退避重试
+_TMDB_SESSION = requests.Session()
+_TMDB_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=2,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+))
+
+# 文件大小单位，依次相差 1024 倍
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
 
 def format_size(size_bytes: int) -> str:
     """
@@ -23,18 +57,16 @@ def format_size(size_bytes: int) -> str:
     Returns:
         格式化后的文件大小字符串，如 "1.23 GB"
     """
-    if size_bytes == 0:
+    size_bytes = int(size_bytes)
+    if size_bytes <= 0:
         return "0 B"
     
-    size_names = ["B", "KB", "MB", "GB", "TB"]
-    i = 0
-    size = float(size_bytes)
+    # 1024 = 2**10，单位级别直接由二进制位数得出，不需要循环除法
+    i = min((size_bytes.bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    # 除数是 2 的幂，2**53 字节以内的除法结果是精确值，:.2f 的舍入与整数运算一致且更快
+    size = size_bytes / (1 << (i * 10))
     
-    while size >= 1024.0 and i < len(size_names) - 1:
-        size /= 1024.0
-        i += 1
-    
-    return f"{size:.2f} {size_names[i]}"
+    return f"{size:.2f} {_SIZE_UNITS[i]}"
 
 
 def extract_quality_from_filename(filename: str) -> str:
@@ -50,24 +82,124 @@ def extract_quality_from_filename(filename: str) -> str:
     if not filename:
         return ""
     
-    filename_lower = filename.lower()
-    quality_patterns = [
-        (r'2160p|4k', '2160p (4K)'),
-        (r'1080p', '1080p'),
-        (r'720p', '720p'),
-        (r'hdr(?!10)', 'HDR'),
-        (r'dolby.?vision|dv', 'Dolby Vision'),
-        (r'imax', 'IMAX'),
-    ]
-    
-    found = []
-    for pattern, label in quality_patterns:
-        if re.search(pattern, filename_lower):
-            found.append(label)
+    matched = {m.lastgroup for m in _QUALITY_RE.finditer(filename)}
+    found = [label for group, label in _QUALITY_LABELS if group in matched]
     
     return ' '.join(found)
 
 
+def as_int(value) -> int:
+    """转换为整数，失败时返回 0（与 Jinja2 的 int 过滤器一致）"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return 0
+
+
+def format_resolution_label(width: int, height: int, quality_lower: str) -> str:
+    """
+    生成分辨率标签：优先根据视频尺寸判断，其次根据画质信息
+    
+    Args:
+        width: 视频宽度（已转为整数）
+        height: 视频高度（已转为整数）
+        quality_lower: 已转为小写的画质信息字符串
+    
+    Returns:
+        分辨率标签，如 "1080p"，无法判断时返回空字符串
+    """
+    if width >= 3800 or height >= 2000:
+        return '2160p (4K)'
+    if width >= 1900 or height >= 1000:
+        return '1080p'
+    if width >= 1200 or height >= 700:
+        return '720p'
+    if '4k' in quality_lower or '2160p' in quality_lower:
+        return '2160p (4K)'
+    if '1080p' in quality_lower:
+        return '1080p'
+    if '720p' in quality_lower:
+        return '720p'
+    return ''
+
+
+def format_hdr_label(quality_lower: str) -> str:
+    """
+    根据画质信息生成 HDR 标签
+    
+    Args:
+        quality_lower: 已转为小写的画质信息字符串
+    
+    Returns:
+        HDR 标签，如 "HDR10｜IMAX"，没有时返回空字符串
+    """
+    has_dv = 'dv' in quality_lower
+    flags = (
+        ('hdr' in quality_lower and not has_dv)
+        | (has_dv or 'dolby vision' in quality_lower) << 1
+        | ('imax' in quality_lower) << 2
+    )
+    return _HDR_LABELS[flags]
+
+
+def _first_result_id(url: str, params: dict, results_key: str) -> Optional[int]:
+    """
+    请求 TMDB 接口并返回第一个结果的 ID
+    
+    Args:
+        url: 请求地址
+        params: 查询参数（由 requests 统一编码）
+        results_key: 响应中结果列表所在的字段
+    
+    Returns:
+        第一个结果的 ID，没有结果时返回 None
+    
+    Raises:
+        requests.RequestException: 请求失败（不缓存，下次重新查找）
+    """
+    response = _TMDB_SESSION.get(url, params=params, timeout=(2, 5))
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    results = response.json().get(results_key) or []
+    # 取第一个结果（通常是最匹配的）
+    return results[0].get('id') if results else None
+
+
+def _find_by_imdb(imdb_id: str, media_type: str, api_key: Optional[str]) -> Optional[int]:
+    """通过 IMDb ID 查找 TMDB ID（最准确）"""
+    params = {'external_source': 'imdb_id'}
+    if api_key:
+        params['api_key'] = api_key
+    
+    # 查找结果可能在 'movie_results' 或 'tv_results' 中
+    tmdb_id = _first_result_id(f"https://api.themoviedb.org/3/find/{imdb_id}", params, f'{media_type}_results')
+    if tmdb_id:
+        logger.info(f"通过 IMDb ID {imdb_id} 找到 TMDB ID: {tmdb_id}")
+    return tmdb_id
+
+
+def _find_by_title(title: str, year: Optional[int], media_type: str, api_key: Optional[str]) -> Optional[int]:
+    """通过标题（和年份，如果有）搜索 TMDB ID"""
+    search_type = 'movie' if media_type == 'movie' else 'tv'
+    params = {'query': title, 'language': 'zh-CN'}
+    if year:
+        params['year'] = year
+    if api_key:
+        params['api_key'] = api_key
+    
+    tmdb_id = _first_result_id(f"https://api.themoviedb.org/3/search/{search_type}", params, 'results')
+    if tmdb_id:
+        if year:
+            logger.info(f"通过标题 '{title}' ({year}) 找到 TMDB ID: {tmdb_id}")
+        else:
+            logger.info(f"通过标题 '{title}' 找到 TMDB ID: {tmdb_id}")
+    return tmdb_id
+
+
 def find_tmdb_id(imdb_id: Optional[str] = None, 
                  title: Optional[str] = None, 
                  year: Optional[int] = None,
@@ -76,7 +208,8 @@ def find_tmdb_id(imdb_id: Optional[str] = None,
     """
     通过 TMDB API 查找 TMDB ID
     
-    优先使用 IMDb ID 查找，如果没有则使用标题和年份搜索
+    优先使用 IMDb ID 查找，如果没有则使用标题和年份搜索。
+    IMDb 命中时不再发起标题搜索，每次查找最多请求两次 TMDB
     
     Args:
         imdb_id: IMDb ID（如 "tt1234567"）
@@ -88,73 +221,53 @@ def find_tmdb_id(imdb_id: Optional[str] = None,
     Returns:
         TMDB ID，如果找不到则返回 None
     """
+    # 输入规范化后作为缓存键；按天分桶，查找结果（包括未找到）最多缓存一天
+    imdb_id = imdb_id.strip().lower() if imdb_id else None
+    title = title.strip() if title else None
     try:
-        # 方法1：通过 IMDb ID 查找（最准确）
-        if imdb_id:
-            try:
-                if api_key:
-                    find_url = f"https://api.themoviedb.org/3/find/{imdb_id}?api_key={api_key}&external_source=imdb_id"
-                else:
-                    find_url = f"https://api.themoviedb.org/3/find/{imdb_id}?external_source=imdb_id"
-                
-                response = requests.get(find_url, timeout=5)
-                if response.status_code == 200:
-                    data = response.json()
-                    # 查找结果可能在 'movie_results' 或 'tv_results' 中
-                    results = data.get(f'{media_type}_results', [])
-                    if results and len(results) > 0:
-                        tmdb_id = results[0].get('id')
-                        if tmdb_id:
-                            logger.info(f"通过 IMDb ID {imdb_id} 找到 TMDB ID: {tmdb_id}")
-                            return tmdb_id
-            except Exception as e:
-                logger.debug(f"通过 IMDb ID 查找失败: {e}")
-        
-        # 方法2：通过标题和年份搜索
-        if title and year:
-            try:
-                search_type = 'movie' if media_type == 'movie' else 'tv'
-                if api_key:
-                    search_url = f"https://api.themoviedb.org/3/search/{search_type}?api_key={api_key}&query={quote(title)}&year={year}&language=zh-CN"
-                else:
-                    search_url = f"https://api.themoviedb.org/3/search/{search_type}?query={quote(title)}&year={year}&language=zh-CN"
-                
-                response = requests.get(search_url, timeout=5)
-                if response.status_code == 200:
-                    data = response.json()
-                    results = data.get('results', [])
-                    if results and len(results) > 0:
-                        # 取第一个结果（通常是最匹配的）
-                        tmdb_id = results[0].get('id')
-                        if tmdb_id:
-                            logger.info(f"通过标题 '{title}' ({year}) 找到 TMDB ID: {tmdb_id}")
-                            return tmdb_id
-            except Exception as e:
-                logger.debug(f"通过标题搜索查找失败: {e}")
-        
-        # 方法3：仅通过标题搜索（没有年份）
-        if title and not year:
-            try:
-                search_type = 'movie' if media_type == 'movie' else 'tv'
-                if api_key:
-                    search_url = f"https://api.themoviedb.org/3/search/{search_type}?api_key={api_key}&query={quote(title)}&language=zh-CN"
-                else:
-                    search_url = f"https://api.themoviedb.org/3/search/{search_type}?query={quote(title)}&language=zh-CN"
-                
-                response = requests.get(search_url, timeout=5)
-                if response.status_code == 200:
-                    data = response.json()
-                    results = data.get('results', [])
-                    if results and len(results) > 0:
-                        tmdb_id = results[0].get('id')
-                        if tmdb_id:
-                            logger.info(f"通过标题 '{title}' 找到 TMDB ID: {tmdb_id}")
-                            return tmdb_id
-            except Exception as e:
-                logger.debug(f"通过标题搜索查找失败: {e}")
-    
+        return _find_tmdb_id_cached(imdb_id, title, year, media_type, api_key, int(time.time() // 86400))
     except Exception as e:
         logger.warning(f"查找 TMDB ID 时出错: {e}")
     
     return None
 
+
+@functools.lru_cache(maxsize=4096)
+def _find_tmdb_id_cached(imdb_id: Optional[str],
+                         title: Optional[str],
+                         year: Optional[int],
+                         media_type: str,
+                         api_key: Optional[str],
+                         day: int) -> Optional[int]:
+    """
+    find_tmdb_id 的实际查找逻辑（带 LRU 缓存）
+    
+    请求失败时抛出异常，lru_cache 不会缓存异常，下次调用会重新查找
+    
+    Args:
+        day: 当前日期编号，只用于让缓存每天失效
+    """
+    if imdb_id and title:
+        imdb_error = None
+        try:
+            tmdb_id = _find_by_imdb(imdb_id, media_type, api_key)
+        except Exception as e:
+            logger.debug(f"通过 IMDb ID 查找失败: {e}")
+            imdb_error = e
+            tmdb_id = None
+        if tmdb_id:
+            # IMDb 结果更准确，命中时不需要标题搜索
+            return tmdb_id
+        tmdb_id = _find_by_title(title, year, media_type, api_key)
+        if tmdb_id is None and imdb_error is not None:
+            # IMDb 查找失败且标题也没找到，不能当作"确定找不到"缓存
+            raise imdb_error
+        return tmdb_id
+    
+    if imdb_id:
+        return _find_by_imdb(imdb_id, media_type, api_key)
+    
+    if title:
+        return _find_by_title(title, year, media_type, api_key)
+    
+    return None
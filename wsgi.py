@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WSGI 入口，供 gunicorn 等生产环境服务器使用
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import app, check_config
+
+check_config()